@@ -0,0 +1,75 @@
+"""Accessibility caption parser for ios-ax.py.
+
+Kept in its own importable, fully annotated module so it can be compiled
+to a native extension with mypyc when dumps get large:
+
+    mypyc ax_parse.py    # builds ax_parse.*.so next to this file
+
+Python prefers the compiled extension over the .py on import, so ios-ax.py
+picks it up with no code change. Without it the pure-Python version runs.
+"""
+
+import re
+import sys
+from functools import lru_cache
+
+# Known iOS accessibility roles (last matching token). Interned, and parsed
+# roles are interned too, so cached results share one object per role.
+_ROLES: frozenset[str] = frozenset(map(sys.intern, (
+    'Button', 'Header', 'StaticText', 'TextField', 'SecureTextField',
+    'Image', 'Cell', 'Table', 'Switch', 'Slider', 'Link',
+    'NavigationBar', 'TabBar', 'Tab', 'SearchField', 'Alert',
+    'Sheet', 'Toolbar', 'SegmentedControl', 'Picker', 'ScrollView',
+    'PageIndicator', 'ProgressIndicator', 'ActivityIndicator',
+    'Stepper', 'Map', 'WebView', 'Toggle', 'Checkbox',
+    'Adjustable', 'Selected', 'Heading',
+)))
+
+# Greedy prefix backtracks from the end, so the match lands on the *last*
+# ", <role>" token; anything after it (", ...") is dropped like before.
+ROLE_RE = re.compile(
+    r'^(.*), \s*('
+    + '|'.join(map(re.escape, sorted(_ROLES, key=lambda r: (-len(r), r))))
+    + r')\s*(?:, .*)?$',
+    re.DOTALL,
+)
+
+
+@lru_cache(maxsize=4096)
+def parse_caption(caption: str | None) -> tuple[str, str, str | None, tuple[str, ...]]:
+    """Parse an accessibility caption into (label, role, value, traits).
+
+    iOS captions are comma-separated strings like:
+        "Wi-Fi, vanCampers, Button"
+        "Settings, Header"
+        "Back"
+
+    Cached — apps repeat captions ("Back", cell templates), so the result is
+    an immutable tuple with traits as a tuple.
+    """
+    if not caption:
+        return ('', '', None, ())
+
+    # Common case: the role is the trailing token — one set lookup, no regex
+    head, sep, tail = caption.rpartition(', ')
+    tail = tail.strip()
+    if sep and tail in _ROLES:
+        role = sys.intern(tail)
+    elif not sep:
+        role = ''
+        head = caption
+    else:
+        m = ROLE_RE.search(caption)
+        if m:
+            role = sys.intern(m.group(2))
+            head = m.group(1)
+        else:
+            role = ''
+            head = caption
+
+    if ', ' not in head:
+        return (head.strip(), role, None, ())
+
+    # At least two parts here: label, then value, then any traits
+    parts: list[str] = [p.strip() for p in head.split(', ')]
+    return (parts[0], role, parts[1], tuple(parts[2:]))
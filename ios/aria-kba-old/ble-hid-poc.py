@@ -13,6 +13,7 @@ Usage:
     #   click
     #   move 100 200
     #   quit
+    # BLE_HID_DEBUG=1 also logs every report and characteristic read/write.
 
 Requires:
     - BlueZ 5.56+ with input plugin disabled in /etc/bluetooth/main.conf
@@ -22,8 +23,12 @@ Requires:
 Based on HeadHodge Bluez-HID-over-Gatt-Keyboard-Peripheral.
 """
 
+import logging
 import os
+import socket
 import sys
+from collections import deque
+from itertools import chain, repeat
 import dbus
 import dbus.exceptions
 import dbus.service
@@ -32,6 +37,8 @@ from gi.repository import GLib
 
 FIFO_PATH = '/tmp/ios-ble-hid.fifo'
 
+log = logging.getLogger('ble-hid')
+
 BLUEZ_SERVICE = 'org.bluez'
 GATT_MANAGER_IFACE = 'org.bluez.GattManager1'
 LE_ADVERTISING_MANAGER_IFACE = 'org.bluez.LEAdvertisingManager1'
@@ -42,74 +49,75 @@ GATT_CHRC_IFACE = 'org.bluez.GattCharacteristic1'
 GATT_DESC_IFACE = 'org.bluez.GattDescriptor1'
 LE_ADVERTISEMENT_IFACE = 'org.bluez.LEAdvertisement1'
 
-# HID Report Map: keyboard (Report ID 1) + mouse (Report ID 2)
-REPORT_MAP = bytes([
+# HID Report Map: keyboard (Report ID 1) + mouse (Report ID 2).
+# Adjacent bytes literals are joined by the compiler into one constant.
+REPORT_MAP = (
     # --- Keyboard (Report ID 1) ---
-    0x05, 0x01,        # Usage Page (Generic Desktop)
-    0x09, 0x06,        # Usage (Keyboard)
-    0xA1, 0x01,        # Collection (Application)
-    0x85, 0x01,        #   Report ID (1)
-    0x05, 0x07,        #   Usage Page (Key Codes)
-    0x19, 0xE0,        #   Usage Minimum (224) - Left Control
-    0x29, 0xE7,        #   Usage Maximum (231) - Right GUI
-    0x15, 0x00,        #   Logical Minimum (0)
-    0x25, 0x01,        #   Logical Maximum (1)
-    0x75, 0x01,        #   Report Size (1)
-    0x95, 0x08,        #   Report Count (8)
-    0x81, 0x02,        #   Input (Data, Variable, Absolute) - Modifier byte
-    0x95, 0x01,        #   Report Count (1)
-    0x75, 0x08,        #   Report Size (8)
-    0x81, 0x01,        #   Input (Constant) - Reserved byte
-    0x95, 0x06,        #   Report Count (6)
-    0x75, 0x08,        #   Report Size (8)
-    0x15, 0x00,        #   Logical Minimum (0)
-    0x25, 0x65,        #   Logical Maximum (101)
-    0x05, 0x07,        #   Usage Page (Key Codes)
-    0x19, 0x00,        #   Usage Minimum (0)
-    0x29, 0x65,        #   Usage Maximum (101)
-    0x81, 0x00,        #   Input (Data, Array) - Key array (6 keys)
+    b'\x05\x01'        # Usage Page (Generic Desktop)
+    b'\x09\x06'        # Usage (Keyboard)
+    b'\xa1\x01'        # Collection (Application)
+    b'\x85\x01'        #   Report ID (1)
+    b'\x05\x07'        #   Usage Page (Key Codes)
+    b'\x19\xe0'        #   Usage Minimum (224) - Left Control
+    b'\x29\xe7'        #   Usage Maximum (231) - Right GUI
+    b'\x15\x00'        #   Logical Minimum (0)
+    b'\x25\x01'        #   Logical Maximum (1)
+    b'\x75\x01'        #   Report Size (1)
+    b'\x95\x08'        #   Report Count (8)
+    b'\x81\x02'        #   Input (Data, Variable, Absolute) - Modifier byte
+    b'\x95\x01'        #   Report Count (1)
+    b'\x75\x08'        #   Report Size (8)
+    b'\x81\x01'        #   Input (Constant) - Reserved byte
+    b'\x95\x06'        #   Report Count (6)
+    b'\x75\x08'        #   Report Size (8)
+    b'\x15\x00'        #   Logical Minimum (0)
+    b'\x25\x65'        #   Logical Maximum (101)
+    b'\x05\x07'        #   Usage Page (Key Codes)
+    b'\x19\x00'        #   Usage Minimum (0)
+    b'\x29\x65'        #   Usage Maximum (101)
+    b'\x81\x00'        #   Input (Data, Array) - Key array (6 keys)
     # LED Output Report (iOS expects this for keyboards)
-    0x05, 0x08,        #   Usage Page (LEDs)
-    0x19, 0x01,        #   Usage Minimum (1) - Num Lock
-    0x29, 0x05,        #   Usage Maximum (5) - Kana
-    0x95, 0x05,        #   Report Count (5)
-    0x75, 0x01,        #   Report Size (1)
-    0x91, 0x02,        #   Output (Data, Variable, Absolute) - LED bits
-    0x95, 0x01,        #   Report Count (1)
-    0x75, 0x03,        #   Report Size (3)
-    0x91, 0x01,        #   Output (Constant) - Padding
-    0xC0,              # End Collection
+    b'\x05\x08'        #   Usage Page (LEDs)
+    b'\x19\x01'        #   Usage Minimum (1) - Num Lock
+    b'\x29\x05'        #   Usage Maximum (5) - Kana
+    b'\x95\x05'        #   Report Count (5)
+    b'\x75\x01'        #   Report Size (1)
+    b'\x91\x02'        #   Output (Data, Variable, Absolute) - LED bits
+    b'\x95\x01'        #   Report Count (1)
+    b'\x75\x03'        #   Report Size (3)
+    b'\x91\x01'        #   Output (Constant) - Padding
+    b'\xc0'            # End Collection
 
     # --- Mouse (Report ID 2) ---
-    0x05, 0x01,        # Usage Page (Generic Desktop)
-    0x09, 0x02,        # Usage (Mouse)
-    0xA1, 0x01,        # Collection (Application)
-    0x85, 0x02,        #   Report ID (2)
-    0x09, 0x01,        #   Usage (Pointer)
-    0xA1, 0x00,        #   Collection (Physical)
-    0x05, 0x09,        #     Usage Page (Buttons)
-    0x19, 0x01,        #     Usage Minimum (1)
-    0x29, 0x03,        #     Usage Maximum (3)
-    0x15, 0x00,        #     Logical Minimum (0)
-    0x25, 0x01,        #     Logical Maximum (1)
-    0x95, 0x03,        #     Report Count (3)
-    0x75, 0x01,        #     Report Size (1)
-    0x81, 0x02,        #     Input (Data, Variable, Absolute) - 3 buttons
-    0x95, 0x01,        #     Report Count (1)
-    0x75, 0x05,        #     Report Size (5)
-    0x81, 0x01,        #     Input (Constant) - Padding
-    0x05, 0x01,        #     Usage Page (Generic Desktop)
-    0x09, 0x30,        #     Usage (X)
-    0x09, 0x31,        #     Usage (Y)
-    0x09, 0x38,        #     Usage (Wheel)
-    0x15, 0x81,        #     Logical Minimum (-127)
-    0x25, 0x7F,        #     Logical Maximum (127)
-    0x75, 0x08,        #     Report Size (8)
-    0x95, 0x03,        #     Report Count (3)
-    0x81, 0x06,        #     Input (Data, Variable, Relative)
-    0xC0,              #   End Collection (Physical)
-    0xC0,              # End Collection
-])
+    b'\x05\x01'        # Usage Page (Generic Desktop)
+    b'\x09\x02'        # Usage (Mouse)
+    b'\xa1\x01'        # Collection (Application)
+    b'\x85\x02'        #   Report ID (2)
+    b'\x09\x01'        #   Usage (Pointer)
+    b'\xa1\x00'        #   Collection (Physical)
+    b'\x05\x09'        #     Usage Page (Buttons)
+    b'\x19\x01'        #     Usage Minimum (1)
+    b'\x29\x03'        #     Usage Maximum (3)
+    b'\x15\x00'        #     Logical Minimum (0)
+    b'\x25\x01'        #     Logical Maximum (1)
+    b'\x95\x03'        #     Report Count (3)
+    b'\x75\x01'        #     Report Size (1)
+    b'\x81\x02'        #     Input (Data, Variable, Absolute) - 3 buttons
+    b'\x95\x01'        #     Report Count (1)
+    b'\x75\x05'        #     Report Size (5)
+    b'\x81\x01'        #     Input (Constant) - Padding
+    b'\x05\x01'        #     Usage Page (Generic Desktop)
+    b'\x09\x30'        #     Usage (X)
+    b'\x09\x31'        #     Usage (Y)
+    b'\x09\x38'        #     Usage (Wheel)
+    b'\x15\x81'        #     Logical Minimum (-127)
+    b'\x25\x7f'        #     Logical Maximum (127)
+    b'\x75\x08'        #     Report Size (8)
+    b'\x95\x03'        #     Report Count (3)
+    b'\x81\x06'        #     Input (Data, Variable, Relative)
+    b'\xc0'            #   End Collection (Physical)
+    b'\xc0'            # End Collection
+)
 
 # USB HID keycode lookup
 CHAR_TO_KEYCODE = {}
@@ -169,6 +177,38 @@ SHIFT_CHARS = {
     ':': ';', '"': "'", '~': '`', '<': ',', '>': '.', '?': '/',
 }
 
+# Release ("all keys up" / "no motion") reports, shared by every timeout
+ZERO_KB = dbus.ByteArray(bytes(8))
+ZERO_MOUSE = dbus.ByteArray(bytes(4))
+
+# Static characteristic values, built once at import
+PROTOCOL_MODE = dbus.ByteArray(b'\x01')  # Report Protocol
+HID_INFO = dbus.ByteArray(b'\x11\x01\x00\x02')  # bcdHID=1.11, bCountryCode=0, Flags=0x02 (normally connectable)
+REPORT_MAP_VALUE = dbus.ByteArray(REPORT_MAP)
+MANUFACTURER = dbus.ByteArray(b'baremobile')
+PNP_ID = dbus.ByteArray(b'\x02\xac\x05\x01\x00\x01\x00')
+BATTERY_FULL = dbus.ByteArray(b'\x64')  # 100%
+LEDS_OFF = dbus.ByteArray(b'\x00')
+EMPTY_VALUE = dbus.ByteArray(b'')
+
+
+def kb_report(modifier, keycode):
+    return dbus.ByteArray(bytes((modifier, 0x00, keycode, 0, 0, 0, 0, 0)))
+
+
+# Complete key-down report per input, built once: plain chars, shifted chars,
+# and named special keys (lowercase). send_key is then a single lookup.
+CHAR_TO_REPORT = {c: kb_report(m, k) for c, (m, k) in CHAR_TO_KEYCODE.items()}
+CHAR_TO_REPORT.update(
+    (c, kb_report(0x02, CHAR_TO_KEYCODE[base][1])) for c, base in SHIFT_CHARS.items())
+CHAR_TO_REPORT.update((name, kb_report(m, k)) for name, (m, k) in SPECIAL_KEYS.items())
+
+# Reports allowed to wait in ReportChrc.backlog once the notify socket is
+# full before typing and mouse motion pause. The socket's send buffer is
+# shrunk to the kernel minimum, so it fills after a handful of reports
+# bluetoothd has not read (6 on x86-64 Linux).
+PIPELINE_MAX = 2
+
 # --- D-Bus base classes (matches BlueZ example-gatt-server pattern) ---
 
 class Application(dbus.service.Object):
@@ -176,17 +216,26 @@ class Application(dbus.service.Object):
 
     def __init__(self, bus):
         self.path = self.PATH
+        self.obj_path = dbus.ObjectPath(self.path)
         self.services = []
+        self.managed_objects = None
         dbus.service.Object.__init__(self, bus, self.path)
 
     def get_path(self):
-        return dbus.ObjectPath(self.path)
+        return self.obj_path
 
     def add_service(self, service):
         self.services.append(service)
+        self.managed_objects = None
 
     @dbus.service.method(DBUS_OM_IFACE, out_signature='a{oa{sa{sv}}}')
     def GetManagedObjects(self):
+        # The GATT tree is fixed once services are added — build it once
+        if self.managed_objects is None:
+            self.managed_objects = self.build_managed_objects()
+        return self.managed_objects
+
+    def build_managed_objects(self):
         response = {}
         for service in self.services:
             response[service.get_path()] = service.get_properties()
@@ -202,33 +251,37 @@ class Service(dbus.service.Object):
 
     def __init__(self, bus, index, uuid, primary):
         self.path = self.PATH_BASE + str(index)
+        self.obj_path = dbus.ObjectPath(self.path)
         self.bus = bus
         self.uuid = uuid
         self.primary = primary
         self.characteristics = []
-        dbus.service.Object.__init__(self, bus, self.path)
-
-    def get_properties(self):
-        return {
+        self.characteristic_paths = dbus.Array(signature='o')
+        # Built once; add_characteristic extends the path array in place
+        self.properties = {
             GATT_SERVICE_IFACE: {
                 'UUID': self.uuid,
                 'Primary': self.primary,
-                'Characteristics': dbus.Array(
-                    self.get_characteristic_paths(), signature='o'),
+                'Characteristics': self.characteristic_paths,
             }
         }
+        dbus.service.Object.__init__(self, bus, self.path)
+
+    def get_properties(self):
+        return self.properties
 
     def get_path(self):
-        return dbus.ObjectPath(self.path)
+        return self.obj_path
 
     def add_characteristic(self, chrc):
         self.characteristics.append(chrc)
+        self.characteristic_paths.append(chrc.get_path())
 
     def get_characteristics(self):
         return self.characteristics
 
     def get_characteristic_paths(self):
-        return [c.get_path() for c in self.characteristics]
+        return self.characteristic_paths
 
     @dbus.service.method(DBUS_PROP_IFACE, in_signature='s', out_signature='a{sv}')
     def GetAll(self, interface):
@@ -240,39 +293,44 @@ class Service(dbus.service.Object):
 
 
 class Characteristic(dbus.service.Object):
+    # Read value until a subclass or WriteValue sets one on the instance
+    value = EMPTY_VALUE
 
     def __init__(self, bus, index, uuid, flags, service):
         self.path = service.path + '/char' + str(index)
+        self.obj_path = dbus.ObjectPath(self.path)
         self.bus = bus
         self.uuid = uuid
         self.service = service
-        self.flags = flags
+        self.flags = dbus.Array(flags, signature='s')
         self.descriptors = []
-        self.value = []
-        dbus.service.Object.__init__(self, bus, self.path)
-
-    def get_properties(self):
-        return {
+        self.descriptor_paths = dbus.Array(signature='o')
+        # Built once; add_descriptor extends the path array in place
+        self.properties = {
             GATT_CHRC_IFACE: {
-                'Service': self.service.get_path(),
+                'Service': service.get_path(),
                 'UUID': self.uuid,
-                'Flags': dbus.Array(self.flags, signature='s'),
-                'Descriptors': dbus.Array(
-                    self.get_descriptor_paths(), signature='o'),
+                'Flags': self.flags,
+                'Descriptors': self.descriptor_paths,
             }
         }
+        dbus.service.Object.__init__(self, bus, self.path)
+
+    def get_properties(self):
+        return self.properties
 
     def get_path(self):
-        return dbus.ObjectPath(self.path)
+        return self.obj_path
 
     def add_descriptor(self, desc):
         self.descriptors.append(desc)
+        self.descriptor_paths.append(desc.get_path())
 
     def get_descriptors(self):
         return self.descriptors
 
     def get_descriptor_paths(self):
-        return [d.get_path() for d in self.descriptors]
+        return self.descriptor_paths
 
     @dbus.service.method(DBUS_PROP_IFACE, in_signature='s', out_signature='a{sv}')
     def GetAll(self, interface):
@@ -284,12 +342,14 @@ class Characteristic(dbus.service.Object):
 
     @dbus.service.method(GATT_CHRC_IFACE, in_signature='a{sv}', out_signature='ay')
     def ReadValue(self, options):
-        print(f'  [ReadValue] {self.uuid} -> {list(self.value)}')
+        if log.isEnabledFor(logging.DEBUG):
+            log.debug('[ReadValue] %s -> %s', self.uuid, bytes(self.value).hex(' '))
         return self.value
 
     @dbus.service.method(GATT_CHRC_IFACE, in_signature='aya{sv}')
     def WriteValue(self, value, options):
-        print(f'  [WriteValue] {self.uuid} <- {list(value)}')
+        if log.isEnabledFor(logging.DEBUG):
+            log.debug('[WriteValue] %s <- %s', self.uuid, bytes(value).hex(' '))
         self.value = value
 
     @dbus.service.method(GATT_CHRC_IFACE)
@@ -306,27 +366,29 @@ class Characteristic(dbus.service.Object):
 
 
 class Descriptor(dbus.service.Object):
+    value = EMPTY_VALUE
 
     def __init__(self, bus, index, uuid, flags, chrc):
         self.path = chrc.path + '/desc' + str(index)
+        self.obj_path = dbus.ObjectPath(self.path)
         self.bus = bus
         self.uuid = uuid
-        self.flags = flags
+        self.flags = dbus.Array(flags, signature='s')
         self.chrc = chrc
-        self.value = []
-        dbus.service.Object.__init__(self, bus, self.path)
-
-    def get_properties(self):
-        return {
+        self.properties = {
             GATT_DESC_IFACE: {
-                'Characteristic': self.chrc.get_path(),
+                'Characteristic': chrc.get_path(),
                 'UUID': self.uuid,
-                'Flags': dbus.Array(self.flags, signature='s'),
+                'Flags': self.flags,
             }
         }
+        dbus.service.Object.__init__(self, bus, self.path)
+
+    def get_properties(self):
+        return self.properties
 
     def get_path(self):
-        return dbus.ObjectPath(self.path)
+        return self.obj_path
 
     @dbus.service.method(DBUS_PROP_IFACE, in_signature='s', out_signature='a{sv}')
     def GetAll(self, interface):
@@ -338,12 +400,14 @@ class Descriptor(dbus.service.Object):
 
     @dbus.service.method(GATT_DESC_IFACE, in_signature='a{sv}', out_signature='ay')
     def ReadValue(self, options):
-        print(f'  [Desc ReadValue] {self.uuid} -> {list(self.value)}')
+        if log.isEnabledFor(logging.DEBUG):
+            log.debug('[Desc ReadValue] %s -> %s', self.uuid, bytes(self.value).hex(' '))
         return self.value
 
     @dbus.service.method(GATT_DESC_IFACE, in_signature='aya{sv}')
     def WriteValue(self, value, options):
-        print(f'  [Desc WriteValue] {self.uuid} <- {list(value)}')
+        if log.isEnabledFor(logging.DEBUG):
+            log.debug('[Desc WriteValue] %s <- %s', self.uuid, bytes(value).hex(' '))
         self.value = value
 
 
@@ -359,14 +423,21 @@ class HIDService(Service):
         self.add_characteristic(ControlPointChrc(bus, 2, self))
         self.add_characteristic(ReportMapChrc(bus, 3, self))
         # Keyboard input report (Report ID 1, 8 bytes)
-        self.kb_report = ReportChrc(bus, 4, self, report_id=1, size=8)
+        self.kb_report = ReportChrc(bus, 4, self, report_id=1, zero=ZERO_KB)
         self.add_characteristic(self.kb_report)
         # Mouse input report (Report ID 2, 4 bytes)
-        self.mouse_report = ReportChrc(bus, 5, self, report_id=2, size=4)
+        self.mouse_report = ReportChrc(bus, 5, self, report_id=2, zero=ZERO_MOUSE)
         self.add_characteristic(self.mouse_report)
         # LED output report (Report ID 1, type=Output)
         self.led_report = OutputReportChrc(bus, 6, self)
         self.add_characteristic(self.led_report)
+        # send_string typing queue, drained by one repeating timer
+        self.text_queue = deque()
+        self.text_timer = None
+        self.text_key_down = False
+        # Mouse motion not yet sent [dx, dy], drained by one repeating timer
+        self.mouse_pending = [0, 0]
+        self.mouse_timer = None
 
 
 class ProtocolModeChrc(Characteristic):
@@ -375,7 +446,7 @@ class ProtocolModeChrc(Characteristic):
     def __init__(self, bus, index, service):
         Characteristic.__init__(self, bus, index, self.UUID,
                                 ['read', 'write-without-response'], service)
-        self.value = dbus.Array([dbus.Byte(0x01)], signature='y')
+        self.value = PROTOCOL_MODE
 
 
 class HIDInfoChrc(Characteristic):
@@ -383,9 +454,7 @@ class HIDInfoChrc(Characteristic):
 
     def __init__(self, bus, index, service):
         Characteristic.__init__(self, bus, index, self.UUID, ['read'], service)
-        # bcdHID=1.11, bCountryCode=0, Flags=0x02 (normally connectable)
-        self.value = dbus.Array([dbus.Byte(0x11), dbus.Byte(0x01),
-                                 dbus.Byte(0x00), dbus.Byte(0x02)], signature='y')
+        self.value = HID_INFO
 
 
 class ControlPointChrc(Characteristic):
@@ -401,7 +470,7 @@ class ReportMapChrc(Characteristic):
 
     def __init__(self, bus, index, service):
         Characteristic.__init__(self, bus, index, self.UUID, ['secure-read'], service)
-        self.value = dbus.Array([dbus.Byte(b) for b in REPORT_MAP], signature='y')
+        self.value = REPORT_MAP_VALUE
 
 
 class ReportReferenceDesc(Descriptor):
@@ -409,34 +478,148 @@ class ReportReferenceDesc(Descriptor):
 
     def __init__(self, bus, index, chrc, report_id, report_type=1):
         Descriptor.__init__(self, bus, index, self.UUID, ['secure-read'], chrc)
-        self.value = dbus.Array([dbus.Byte(report_id), dbus.Byte(report_type)],
-                                signature='y')
+        self.value = dbus.ByteArray(bytes((report_id, report_type)))
 
 
 class ReportChrc(Characteristic):
+    """Input report. Notifications go over an AcquireNotify socket when BlueZ
+    hands us one (one send() per report), else via PropertiesChanged."""
     UUID = '00002a4d-0000-1000-8000-00805f9b34fb'
 
-    def __init__(self, bus, index, service, report_id, size=8):
+    def __init__(self, bus, index, service, report_id, zero=ZERO_KB):
         Characteristic.__init__(self, bus, index, self.UUID,
                                 ['secure-read', 'notify'], service)
         self.report_id = report_id
         self.notifying = False
+        # Subscribed through StartNotify (signals), as opposed to an acquired fd
+        self.notify_started = False
+        self.notify_sock = None
+        self.notify_watch = None
+        # Reports bluetoothd has not taken off the notify socket yet
+        self.backlog = deque()
+        self.backlog_watch = None
         self.add_descriptor(ReportReferenceDesc(bus, 0, self, report_id, report_type=1))
-        self.value = dbus.Array([dbus.Byte(0)] * size, signature='y')
+        self.value = zero
+        # PropertiesChanged arguments, reused for every report; the signal is
+        # marshalled before it returns, so updating Value in place is safe
+        self.changed = {'Value': self.value}
+        self.invalidated = dbus.Array(signature='s')
         self.label = 'KB' if report_id == 1 else 'MOUSE'
 
+    def get_properties(self):
+        props = Characteristic.get_properties(self)
+        # Presence of NotifyAcquired tells BlueZ we implement AcquireNotify.
+        # Set on the shared dict, so the cached GetManagedObjects reply sees it too.
+        props[GATT_CHRC_IFACE]['NotifyAcquired'] = dbus.Boolean(self.notify_sock is not None)
+        return props
+
     def StartNotify(self):
+        self.notify_started = True
         self.notifying = True
         print(f'  Report {self.report_id} ({self.label}): notifications ON')
 
     def StopNotify(self):
+        self.notify_started = False
         self.notifying = False
         print(f'  Report {self.report_id} ({self.label}): notifications OFF')
 
+    @dbus.service.method(GATT_CHRC_IFACE, in_signature='a{sv}', out_signature='hq')
+    def AcquireNotify(self, options):
+        """BlueZ calls this when the central subscribes. We keep one end of a
+        SEQPACKET pair; bluetoothd reads the other and sends each packet as a
+        notification — no D-Bus signal per report."""
+        self.release_notify()
+        ours, theirs = socket.socketpair(socket.AF_UNIX, socket.SOCK_SEQPACKET)
+        ours.setblocking(False)
+        # The default send buffer holds ~280 reports before EAGAIN, hiding a
+        # stalled link from congested(); 1 is clamped up to the kernel minimum
+        ours.setsockopt(socket.SOL_SOCKET, socket.SO_SNDBUF, 1)
+        self.notify_sock = ours
+        self.notifying = True
+        self.notify_watch = GLib.io_add_watch(
+            ours.fileno(), GLib.IOCondition.HUP | GLib.IOCondition.ERR, self.on_notify_hup)
+        fd = dbus.types.UnixFd(theirs)  # dups the fd
+        theirs.close()
+        mtu = int(options.get('mtu', 23))
+        # BlueZ calls AcquireNotify instead of StartNotify once NotifyAcquired
+        # is exposed — same ON line, the integration tests wait for it
+        print(f'  Report {self.report_id} ({self.label}): notifications ON (notify fd, mtu={mtu})')
+        return fd, dbus.UInt16(mtu)
+
+    def on_notify_hup(self, source, condition):
+        # bluetoothd closed its end — central unsubscribed or disconnected
+        self.notify_watch = None  # returning False removes the watch
+        self.release_notify()
+        print(f'  Report {self.report_id} ({self.label}): notifications OFF (notify fd closed)')
+        return False
+
+    def notify_write_failed(self, error):
+        self.release_notify()
+        if self.notifying:
+            print(f'  [{self.label}] notify fd write failed ({error}), falling back to signal')
+        else:
+            print(f'  Report {self.report_id} ({self.label}): notifications OFF '
+                  f'(notify fd write failed: {error})')
+
+    def release_notify(self):
+        if self.notify_watch is not None:
+            GLib.source_remove(self.notify_watch)
+            self.notify_watch = None
+        if self.backlog_watch is not None:
+            GLib.source_remove(self.backlog_watch)
+            self.backlog_watch = None
+        self.backlog.clear()
+        if self.notify_sock is not None:
+            self.notify_sock.close()
+            self.notify_sock = None
+            # The fd was the subscription; only a StartNotify one outlives it
+            self.notifying = self.notify_started
+
+    def congested(self):
+        """True when PIPELINE_MAX reports are queued behind a full notify socket."""
+        return len(self.backlog) >= PIPELINE_MAX
+
+    def drain_backlog(self, source, condition):
+        while self.backlog:
+            try:
+                self.notify_sock.send(self.backlog[0])
+            except BlockingIOError:
+                return True
+            except OSError as e:
+                # bluetoothd closed its end — same as HUP; queued reports are dropped
+                self.backlog_watch = None  # returning False removes the watch
+                self.notify_write_failed(e)
+                return False
+            self.backlog.popleft()
+        self.backlog_watch = None
+        return False
+
     def send_report(self, data):
-        self.value = dbus.Array([dbus.Byte(b) for b in data], signature='y')
-        print(f'  [{self.label}] notify: {[hex(b) for b in data]}  notifying={self.notifying}')
-        self.PropertiesChanged(GATT_CHRC_IFACE, {'Value': self.value}, [])
+        # ByteArray marshals as 'ay' in one C call instead of one dbus.Byte per byte
+        self.value = data if isinstance(data, dbus.ByteArray) else dbus.ByteArray(bytes(data))
+        if log.isEnabledFor(logging.DEBUG):  # skip formatting on the hot path
+            log.debug('[%s] notify: %s  notifying=%s', self.label, self.value.hex(' '), self.notifying)
+        if self.notify_sock is not None:
+            if self.backlog:
+                self.backlog.append(self.value)  # stay in order behind queued reports
+                return
+            try:
+                self.notify_sock.send(self.value)
+                return
+            except BlockingIOError:
+                # bluetoothd is behind (slow link) — hold reports until the socket drains
+                self.backlog.append(self.value)
+                self.backlog_watch = GLib.io_add_watch(
+                    self.notify_sock.fileno(), GLib.IOCondition.OUT, self.drain_backlog)
+                return
+            except OSError as e:
+                # bluetoothd closed its end — same as HUP. Falls through to a
+                # signal only if the central also subscribed via StartNotify.
+                self.notify_write_failed(e)
+        if not self.notifying:
+            return  # no central subscribed — nobody would receive the signal
+        self.changed['Value'] = self.value
+        self.PropertiesChanged(GATT_CHRC_IFACE, self.changed, self.invalidated)
 
 
 class OutputReportChrc(Characteristic):
@@ -447,11 +630,12 @@ class OutputReportChrc(Characteristic):
         Characteristic.__init__(self, bus, index, self.UUID,
                                 ['secure-read', 'write', 'write-without-response'], service)
         self.add_descriptor(ReportReferenceDesc(bus, 0, self, 1, report_type=2))  # type=2 = Output, Report ID 1 (keyboard)
-        self.value = dbus.Array([dbus.Byte(0)], signature='y')
+        self.value = LEDS_OFF
 
     def WriteValue(self, value, options):
         self.value = value
-        print(f'  [LED] write: {[hex(int(b)) for b in value]}')
+        if log.isEnabledFor(logging.DEBUG):
+            log.debug('[LED] write: %s', bytes(value).hex(' '))
 
 
 # --- Device Information Service ---
@@ -470,7 +654,7 @@ class ManufacturerChrc(Characteristic):
 
     def __init__(self, bus, index, service):
         Characteristic.__init__(self, bus, index, self.UUID, ['read'], service)
-        self.value = dbus.Array([dbus.Byte(c) for c in b'baremobile'], signature='y')
+        self.value = MANUFACTURER
 
 
 class PnPIDChrc(Characteristic):
@@ -478,9 +662,7 @@ class PnPIDChrc(Characteristic):
 
     def __init__(self, bus, index, service):
         Characteristic.__init__(self, bus, index, self.UUID, ['read'], service)
-        self.value = dbus.Array([dbus.Byte(b) for b in
-                                 bytes([0x02, 0xAC, 0x05, 0x01, 0x00, 0x01, 0x00])],
-                                signature='y')
+        self.value = PNP_ID
 
 
 # --- Battery Service ---
@@ -498,7 +680,7 @@ class BatteryLevelChrc(Characteristic):
 
     def __init__(self, bus, index, service):
         Characteristic.__init__(self, bus, index, self.UUID, ['read', 'notify'], service)
-        self.value = dbus.Array([dbus.Byte(100)], signature='y')
+        self.value = BATTERY_FULL
 
 
 # --- BLE Advertisement ---
@@ -530,33 +712,42 @@ class Advertisement(dbus.service.Object):
 
 # --- Input functions ---
 
+# Release callbacks take hid_service as a timeout_add argument, so no
+# closure is allocated per keypress/click. Both return False to fire once.
+
+def release_kb(hid_service):
+    """Timeout callback: all keys up."""
+    hid_service.kb_report.send_report(ZERO_KB)
+    return False
+
+
+def release_mouse(hid_service):
+    """Timeout callback: all buttons up."""
+    hid_service.mouse_report.send_report(ZERO_MOUSE)
+    return False
+
+
+def key_report(char):
+    # Chars are matched exactly (case = shift); named special keys
+    # (enter, space, right, left, etc.) case-insensitively
+    return CHAR_TO_REPORT.get(char) or CHAR_TO_REPORT.get(char.lower())
+
+
 def send_key(hid_service, char):
-    # Named special keys (enter, space, right, left, etc.)
-    if char.lower() in SPECIAL_KEYS:
-        modifier, keycode = SPECIAL_KEYS[char.lower()]
-        hid_service.kb_report.send_report([modifier, 0x00, keycode, 0, 0, 0, 0, 0])
-        GLib.timeout_add(80, lambda: hid_service.kb_report.send_report([0] * 8) or False)
-        return
-    if char in SHIFT_CHARS:
-        base = SHIFT_CHARS[char]
-        modifier = 0x02  # Left Shift
-    elif char in CHAR_TO_KEYCODE:
-        base = char
-        modifier = 0
-    else:
+    report = key_report(char)
+    if report is None:
         print(f'  Unknown character: {char!r}')
         return
-    _, keycode = CHAR_TO_KEYCODE[base]
-    # Key down
-    hid_service.kb_report.send_report([modifier, 0x00, keycode, 0, 0, 0, 0, 0])
-    # Key up after 80ms
-    GLib.timeout_add(80, lambda: hid_service.kb_report.send_report([0] * 8) or False)
+    # Key down and key up back to back — each is its own notification, so
+    # iOS still sees a press; no release timer needed
+    hid_service.kb_report.send_report(report)
+    hid_service.kb_report.send_report(ZERO_KB)
 
 
 def send_hid(hid_service, modifier, keycode):
     """Send raw HID report: modifier byte + keycode."""
     hid_service.kb_report.send_report([modifier, 0x00, keycode, 0, 0, 0, 0, 0])
-    GLib.timeout_add(80, lambda: hid_service.kb_report.send_report([0] * 8) or False)
+    GLib.timeout_add(80, release_kb, hid_service)
 
 
 def send_keys_combo(hid_service, key_names):
@@ -581,39 +772,121 @@ def send_keys_combo(hid_service, key_names):
         keycodes.append(0)
     report = [modifier, 0x00] + keycodes[:6]
     hid_service.kb_report.send_report(report)
-    GLib.timeout_add(80, lambda: hid_service.kb_report.send_report([0] * 8) or False)
+    GLib.timeout_add(80, release_kb, hid_service)
+
+
+TYPE_INTERVAL = 100  # ms between a char's press and release, and release and next press
+
+
+def type_next(hid_service):
+    """Timer callback: alternately press the next queued char and release it.
+    Stops once the last key is up and the queue is empty."""
+    queue = hid_service.text_queue
+    if hid_service.text_key_down:
+        hid_service.text_key_down = False
+        hid_service.kb_report.send_report(ZERO_KB)
+        if queue:
+            return True
+        hid_service.text_timer = None
+        return False
+    if not queue:
+        hid_service.text_timer = None
+        return False
+    if hid_service.kb_report.congested():
+        return True  # link is behind — retry on the next tick
+    while queue:
+        char = queue.popleft()
+        report = key_report(char)
+        if report is not None:
+            hid_service.kb_report.send_report(report)
+            hid_service.text_key_down = True
+            return True
+        print(f'  Unknown character: {char!r}')
+    hid_service.text_timer = None
+    return False
 
 
 def send_string(hid_service, text):
-    for i, char in enumerate(text):
-        GLib.timeout_add(i * 200, lambda c=char: send_key(hid_service, c) or False)
+    # One repeating timer types the whole queue, releases included — no
+    # per-char timers. Text sent while typing is in progress queues behind it.
+    hid_service.text_queue.extend(text)
     print(f'  Sending {len(text)} chars...')
+    if hid_service.text_timer is None and type_next(hid_service):
+        hid_service.text_timer = GLib.timeout_add(TYPE_INTERVAL, type_next, hid_service)
+
+
+def pump_reports(report_chrc, reports, interval):
+    """Send reports one per interval (first one now) on a single repeating timer."""
+    it = iter(reports)
+
+    def tick():
+        report = next(it, None)
+        if report is None:
+            return False
+        report_chrc.send_report(report)
+        return True
+
+    if tick():
+        GLib.timeout_add(interval, tick)
+
+
+MOUSE_STEP = 50  # units per report — larger steps for slow tracking settings
+MOUSE_INTERVAL = 8  # ms between reports (~125Hz, matches real mouse polling rate)
+
+
+def div_round(n, d):
+    """Integer n / d rounded to nearest, ties to even (same as round(n / d))."""
+    q, r = divmod(n, d)
+    r += r
+    if r > d or (r == d and q & 1):
+        q += 1
+    return q
+
+
+def flush_mouse(hid_service):
+    """Timer callback: send the next step of pending motion.
+
+    Splits what is left into equal steps of at most MOUSE_STEP along a
+    straight line and sends one. A zero report follows the last step.
+    """
+    pending = hid_service.mouse_pending
+    px, py = pending
+    if not px and not py:
+        hid_service.mouse_report.send_report(ZERO_MOUSE)
+        hid_service.mouse_timer = None
+        return False
+    if hid_service.mouse_report.congested():
+        return True  # link is behind — motion keeps accumulating in pending
+    # steps > max(|px|, |py|) / MOUSE_STEP - 1, so each step stays below
+    # 2 * MOUSE_STEP and fits the report's -127..127 without clamping
+    # (as long as MOUSE_STEP <= 63)
+    steps = max(abs(px), abs(py)) // MOUSE_STEP or 1
+    step_dx = div_round(px, steps)
+    step_dy = div_round(py, steps)
+    pending[0] -= step_dx
+    pending[1] -= step_dy
+    hid_service.mouse_report.send_report(
+        dbus.ByteArray(bytes((0x00, step_dx & 0xFF, step_dy & 0xFF, 0x00))))
+    return True
 
 
 def move_mouse(hid_service, dx, dy):
     """Move mouse by sending rapid small-step reports (like a real mouse sensor).
-    iOS clamps single-report movement — must send many small deltas at high frequency."""
-    STEP = 50  # units per report — larger steps for slow tracking settings
-    INTERVAL = 8  # ms between reports (~125Hz, matches real mouse polling rate)
-    steps = max(abs(dx), abs(dy), 1) // STEP or 1
-    sx = dx / steps if steps else 0
-    sy = dy / steps if steps else 0
-    for i in range(steps):
-        step_dx = int(round(sx))
-        step_dy = int(round(sy))
-        step_dx = max(-127, min(127, step_dx))
-        step_dy = max(-127, min(127, step_dy))
-        GLib.timeout_add(i * INTERVAL, lambda sdx=step_dx, sdy=step_dy:
-                         hid_service.mouse_report.send_report(
-                             [0x00, sdx & 0xFF, sdy & 0xFF, 0x00]) or False)
-    # Zero report after last step
-    GLib.timeout_add(steps * INTERVAL, lambda:
-                     hid_service.mouse_report.send_report([0, 0, 0, 0]) or False)
+    iOS clamps single-report movement — must send many small deltas at high frequency.
+
+    Motion is added to hid_service.mouse_pending and drained by one timer, so
+    a move issued while another is still running merges into it instead of
+    racing it with a second stream of reports."""
+    pending = hid_service.mouse_pending
+    pending[0] += dx
+    pending[1] += dy
+    if hid_service.mouse_timer is None and flush_mouse(hid_service):
+        hid_service.mouse_timer = GLib.timeout_add(MOUSE_INTERVAL, flush_mouse, hid_service)
 
 
 def click(hid_service):
     hid_service.mouse_report.send_report([0x01, 0x00, 0x00, 0x00])
-    GLib.timeout_add(80, lambda: hid_service.mouse_report.send_report([0, 0, 0, 0]) or False)
+    GLib.timeout_add(80, release_mouse, hid_service)
 
 
 def scroll(hid_service, amount):
@@ -622,13 +895,8 @@ def scroll(hid_service, amount):
     INTERVAL = 50  # ms between scroll reports
     steps = abs(amount)
     direction = 1 if amount > 0 else -1
-    for i in range(steps):
-        val = direction * STEP
-        GLib.timeout_add(i * INTERVAL, lambda v=val:
-                         hid_service.mouse_report.send_report(
-                             [0x00, 0x00, 0x00, v & 0xFF]) or False)
-    GLib.timeout_add(steps * INTERVAL, lambda:
-                     hid_service.mouse_report.send_report([0, 0, 0, 0]) or False)
+    notch = dbus.ByteArray(bytes((0x00, 0x00, 0x00, (direction * STEP) & 0xFF)))
+    pump_reports(hid_service.mouse_report, chain(repeat(notch, steps), (ZERO_MOUSE,)), INTERVAL)
 
 
 # --- Main ---
@@ -679,7 +947,8 @@ class PairingAgent(dbus.service.Object):
 
 
 def find_adapter(bus):
-    remote_om = dbus.Interface(bus.get_object(BLUEZ_SERVICE, '/'), DBUS_OM_IFACE)
+    remote_om = dbus.Interface(
+        bus.get_object(BLUEZ_SERVICE, '/', introspect=False), DBUS_OM_IFACE)
     objects = remote_om.GetManagedObjects()
     for path, interfaces in objects.items():
         if GATT_MANAGER_IFACE in interfaces:
@@ -688,6 +957,9 @@ def find_adapter(bus):
 
 
 def main():
+    logging.basicConfig(
+        level=logging.DEBUG if os.environ.get('BLE_HID_DEBUG') else logging.INFO,
+        format='  %(message)s')
     dbus.mainloop.glib.DBusGMainLoop(set_as_default=True)
     bus = dbus.SystemBus()
 
@@ -697,22 +969,40 @@ def main():
         sys.exit(1)
     print(f'Adapter: {adapter_path}')
 
-    # Set adapter name
-    adapter_props = dbus.Interface(
-        bus.get_object(BLUEZ_SERVICE, adapter_path), DBUS_PROP_IFACE)
-    adapter_props.Set('org.bluez.Adapter1', 'Alias', 'baremobile')
-    adapter_props.Set('org.bluez.Adapter1', 'Powered', dbus.Boolean(True))
-    adapter_props.Set('org.bluez.Adapter1', 'Pairable', dbus.Boolean(True))
+    mainloop = GLib.MainLoop()
+
+    # BlueZ proxies are made with introspect=False: introspecting costs a
+    # blocking round trip per object, so calls pass explicit signatures instead
+    adapter = bus.get_object(BLUEZ_SERVICE, adapter_path, introspect=False)
+
+    # Set adapter name. The Sets are sent without waiting for each reply;
+    # bluetoothd handles them in order, ahead of the registrations below.
+    adapter_props = dbus.Interface(adapter, DBUS_PROP_IFACE)
+
+    def on_adapter_set():
+        pass
+
+    def set_adapter(name, value):
+        def on_error(error):
+            print(f'ERROR setting adapter {name}: {error}')
+            mainloop.quit()
+        adapter_props.Set('org.bluez.Adapter1', name, value, signature='ssv',
+                          reply_handler=on_adapter_set, error_handler=on_error)
+
+    set_adapter('Alias', 'baremobile')
+    set_adapter('Powered', dbus.Boolean(True))
+    set_adapter('Pairable', dbus.Boolean(True))
     # Do NOT set Discoverable=True — that enables Classic BT which creates a
     # duplicate entry on iPhone. BLE discovery uses the LE advertisement only.
-    adapter_props.Set('org.bluez.Adapter1', 'Discoverable', dbus.Boolean(False))
+    # Set it False explicitly in case an earlier session left it on.
+    set_adapter('Discoverable', dbus.Boolean(False))
 
     # Register pairing agent — auto-accepts bonding from iPhone
     agent = PairingAgent(bus)
     agent_manager = dbus.Interface(
-        bus.get_object(BLUEZ_SERVICE, '/org/bluez'), AGENT_MANAGER_IFACE)
-    agent_manager.RegisterAgent(agent.PATH, 'KeyboardDisplay')
-    agent_manager.RequestDefaultAgent(agent.PATH)
+        bus.get_object(BLUEZ_SERVICE, '/org/bluez', introspect=False), AGENT_MANAGER_IFACE)
+    agent_manager.RegisterAgent(agent.PATH, 'KeyboardDisplay', signature='os')
+    agent_manager.RequestDefaultAgent(agent.PATH, signature='o')
     print('Pairing agent registered (auto-accept)')
 
     # Build GATT application
@@ -722,14 +1012,10 @@ def main():
     app.add_service(DeviceInfoService(bus, 1))
     app.add_service(BatteryService(bus, 2))
 
-    gatt_manager = dbus.Interface(
-        bus.get_object(BLUEZ_SERVICE, adapter_path), GATT_MANAGER_IFACE)
-    adv_manager = dbus.Interface(
-        bus.get_object(BLUEZ_SERVICE, adapter_path), LE_ADVERTISING_MANAGER_IFACE)
+    gatt_manager = dbus.Interface(adapter, GATT_MANAGER_IFACE)
+    adv_manager = dbus.Interface(adapter, LE_ADVERTISING_MANAGER_IFACE)
     adv = Advertisement(bus)
 
-    mainloop = GLib.MainLoop()
-
     def on_app_registered():
         print('GATT application registered OK')
 
@@ -746,12 +1032,12 @@ def main():
         mainloop.quit()
 
     gatt_manager.RegisterApplication(
-        app.get_path(), {},
+        app.get_path(), {}, signature='oa{sv}',
         reply_handler=on_app_registered,
         error_handler=on_app_error)
 
     adv_manager.RegisterAdvertisement(
-        adv.path, {},
+        adv.path, {}, signature='oa{sv}',
         reply_handler=on_adv_registered,
         error_handler=on_adv_error)
 
@@ -785,41 +1071,54 @@ def main():
         else:
             print(f'  Unknown: {cmd}. Type "help" for commands.')
 
-    def watch_stdin(source, condition):
-        if condition & GLib.IOCondition.HUP:
-            return False
-        line = sys.stdin.readline()
-        if line:
-            handle_command(line)
-            sys.stdout.write('> ')
-            sys.stdout.flush()
-        return True
+    def line_watch(fd, on_line, on_eof):
+        """IO watch callback that reads whatever is available from fd and
+        calls on_line per complete line. The watch only fires when fd is
+        readable, so one os.read never blocks; a partial line is buffered
+        until the rest arrives (or flushed at EOF)."""
+        buf = bytearray()
+
+        def watch(source, condition):
+            try:
+                chunk = os.read(fd, 4096)
+            except BlockingIOError:
+                return True
+            if not chunk:
+                if buf:  # last line without a trailing newline
+                    on_line(buf.decode(errors='replace'))
+                    buf.clear()
+                return on_eof()
+            buf.extend(chunk)
+            *lines, rest = buf.split(b'\n')
+            buf[:] = rest
+            for line in lines:
+                on_line(line.decode(errors='replace'))
+            return True
 
-    GLib.io_add_watch(sys.stdin, GLib.IOCondition.IN | GLib.IOCondition.HUP, watch_stdin)
+        return watch
+
+    def stdin_line(line):
+        handle_command(line)
+        sys.stdout.write('> ')
+        sys.stdout.flush()
+
+    stdin_fd = sys.stdin.fileno()
+    GLib.io_add_watch(stdin_fd, GLib.IOCondition.IN | GLib.IOCondition.HUP,
+                      line_watch(stdin_fd, stdin_line, lambda: False))
 
     # FIFO for external control (ios.js writes commands here)
-    fifo_fd = None
     def setup_fifo():
-        nonlocal fifo_fd
         try:
             os.unlink(FIFO_PATH)
         except FileNotFoundError:
             pass
         os.mkfifo(FIFO_PATH)
         os.chmod(FIFO_PATH, 0o666)
-        # Open read+write so the pipe stays open when no writer is connected
-        fifo_fd = os.open(FIFO_PATH, os.O_RDONLY | os.O_NONBLOCK)
-        fifo_file = os.fdopen(fifo_fd, 'r')
-
-        def watch_fifo(source, condition):
-            if condition & GLib.IOCondition.HUP:
-                return True  # keep watching — writer disconnected, will reconnect
-            line = fifo_file.readline()
-            if line:
-                handle_command(line)
-            return True
-
-        GLib.io_add_watch(fifo_file, GLib.IOCondition.IN | GLib.IOCondition.HUP, watch_fifo)
+        # Open read+write so the pipe stays open when no writer is connected —
+        # a read-only end would report HUP (and wake the loop) nonstop between writers
+        fifo_fd = os.open(FIFO_PATH, os.O_RDWR | os.O_NONBLOCK)
+        GLib.io_add_watch(fifo_fd, GLib.IOCondition.IN,
+                          line_watch(fifo_fd, handle_command, lambda: True))
         print(f'FIFO: {FIFO_PATH}')
 
     setup_fifo()
@@ -2,119 +2,269 @@
 """iOS accessibility helper — dump elements and navigate focus.
 
 Usage:
-    python3.12 scripts/ios-ax.py --rsd HOST PORT dump
-    python3.12 scripts/ios-ax.py --rsd HOST PORT focus N
+    python3.12 scripts/ios-ax.py --rsd HOST PORT dump [--ndjson] [--compact] [--no-ref]
+    python3.12 scripts/ios-ax.py --rsd HOST PORT focus N [--total COUNT]
+    python3.12 scripts/ios-ax.py --rsd HOST PORT serve   # JSON commands on stdin
 """
 
-import argparse
 import asyncio
-import json
+import io
 import sys
+from itertools import count, repeat
+from types import SimpleNamespace
 
-from pymobiledevice3.remote.remote_service_discovery import RemoteServiceDiscoveryService
-from pymobiledevice3.services.accessibilityaudit import AccessibilityAudit, Direction
+try:
+    import orjson
+except ImportError:  # optional — stdlib json is fine, just slower on big dumps
+    orjson = None
+    import json
+
+from ax_parse import parse_caption
+
+# pymobiledevice3 is imported inside the functions that need it — it pulls in
+# the whole RSD/tunnel stack, which --help and argument errors never use.
+
+
+def dumps(obj):
+    """Encode obj as compact UTF-8 JSON bytes (orjson when available)."""
+    if orjson is not None:
+        return orjson.dumps(obj)
+    return json.dumps(obj, separators=(',', ':')).encode()
+
+
+def loads(data):
+    """Decode JSON from bytes or str."""
+    if orjson is not None:
+        return orjson.loads(data)
+    return json.loads(data)
+
+
+def write_json(obj):
+    """Write obj as one line of JSON to stdout."""
+    sys.stdout.buffer.write(dumps(obj) + b'\n')
+
+
+# Dumps are written as many small records; a large buffer on the raw fd
+# coalesces them into a handful of write(2) calls instead of one per 8 KiB.
+STDOUT_BUFFER = 1 << 16
+
+
+def open_stdout():
+    """Open fd 1 as a binary writer with a STDOUT_BUFFER-sized buffer."""
+    sys.stdout.flush()
+    return open(sys.stdout.fileno(), 'wb', buffering=STDOUT_BUFFER, closefd=False)
 
 
 async def connect_rsd(host, port):
+    from pymobiledevice3.remote.remote_service_discovery import RemoteServiceDiscoveryService
+
     rsd = RemoteServiceDiscoveryService((host, int(port)))
     await rsd.connect()
     return rsd
 
 
-def parse_caption(caption):
-    """Parse an accessibility caption into label, role, value, traits.
+# Column order of --compact rows (FIELDS[1:] with --no-ref)
+FIELDS = ('ref', 'label', 'role', 'value', 'traits', 'caption')
+
+
+def element_row(ref, caption):
+    """Build the compact output row for one element, in FIELDS order.
 
-    iOS captions are comma-separated strings like:
-        "Wi-Fi, vanCampers, Button"
-        "Settings, Header"
-        "Back"
+    ref=None drops the ref column — it always equals the row's index.
     """
-    if not caption:
-        return {'label': '', 'role': '', 'value': None, 'traits': []}
-
-    parts = [p.strip() for p in caption.split(', ')]
-
-    # Known iOS accessibility roles (last matching token)
-    roles = {
-        'Button', 'Header', 'StaticText', 'TextField', 'SecureTextField',
-        'Image', 'Cell', 'Table', 'Switch', 'Slider', 'Link',
-        'NavigationBar', 'TabBar', 'Tab', 'SearchField', 'Alert',
-        'Sheet', 'Toolbar', 'SegmentedControl', 'Picker', 'ScrollView',
-        'PageIndicator', 'ProgressIndicator', 'ActivityIndicator',
-        'Stepper', 'Map', 'WebView', 'Toggle', 'Checkbox',
-        'Adjustable', 'Selected', 'Heading',
+    label, role, value, traits = parse_caption(caption)
+    if ref is None:
+        return (label, role, value, traits, caption)
+    return (ref, label, role, value, traits, caption)
+
+
+def element_record(ref, caption):
+    """Build the output dict for one element; ref=None omits the ref key."""
+    label, role, value, traits = parse_caption(caption)
+    if ref is None:
+        return {'label': label, 'role': role, 'value': value,
+                'traits': traits, 'caption': caption}
+    return {
+        'ref': ref,
+        'label': label,
+        'role': role,
+        'value': value,
+        'traits': traits,
+        'caption': caption,
     }
 
-    if len(parts) == 1:
-        return {'label': parts[0], 'role': '', 'value': None, 'traits': []}
 
-    # Scan from the end for a role token
-    role = ''
-    role_idx = len(parts)
-    for i in range(len(parts) - 1, 0, -1):
-        if parts[i] in roles:
-            role = parts[i]
-            role_idx = i
-            break
+def write_dump(ax, out, ndjson=False, compact=False, no_ref=False):
+    """Stream every element of an open AccessibilityAudit to out as JSON.
 
-    label = parts[0]
-    value = None
-    traits = []
+    Default output is a single JSON array line; with ndjson=True each
+    element is written on its own line instead (pipeable to jq). With
+    compact=True each element is a [ref, label, ...] row in FIELDS order
+    instead of an object, roughly halving the bytes on the wire. With
+    no_ref=True the ref field is left out; consumers use the position.
+    """
+    # Parsing stays inline: each element costs a focus move + event round
+    # trip to the device, which dwarfs the microseconds parse_caption takes
+    # (most of which are cache hits). A process pool's startup and pickling
+    # would cost more than it saves and would force buffering the stream.
+    build = element_row if compact else element_record
+    refs = repeat(None) if no_ref else count()
+    records = (dumps(build(ref, el.caption or ''))
+               for ref, el in zip(refs, ax.iter_elements()))
+    if ndjson:
+        out.writelines(r + b'\n' for r in records)
+        return
+    out.write(b'[')
+    first = next(records, None)
+    if first is not None:
+        out.write(first)
+        out.writelines(b',' + r for r in records)
+    out.write(b']\n')
 
-    # Middle parts (between label and role) — first is value, rest are traits
-    middle = parts[1:role_idx]
-    if middle:
-        value = middle[0]
-        traits = middle[1:]
 
-    return {'label': label, 'role': role, 'value': value, 'traits': traits}
+def move_focus_to(ax, target_ref, total=None):
+    """Move focus of an open AccessibilityAudit to element at ref index.
 
+    AccessibilityAudit only offers relative moves (First/Last/Next/Previous),
+    so reaching ref N costs N moves. When the element count from the last
+    dump is known, walk back from the end if that is shorter. A total that
+    does not cover target_ref is ignored.
+    """
+    from pymobiledevice3.services.accessibilityaudit import Direction
 
-def cmd_dump(rsd):
-    """Dump all accessibility elements as JSON array."""
-    elements = []
-    with AccessibilityAudit(rsd) as ax:
-        for i, el in enumerate(ax.iter_elements()):
-            parsed = parse_caption(el.caption)
-            elements.append({
-                'ref': i,
-                'label': parsed['label'],
-                'role': parsed['role'],
-                'value': parsed['value'],
-                'traits': parsed['traits'],
-                'caption': el.caption or '',
-            })
-    json.dump(elements, sys.stdout)
-    sys.stdout.write('\n')
-
-
-def cmd_focus(rsd, target_ref):
-    """Navigate focus to element at ref index."""
-    with AccessibilityAudit(rsd) as ax:
-        # Reset to first element
+    from_end = None if total is None else total - 1 - target_ref
+    if from_end is not None and 0 <= from_end < target_ref:
+        ax.move_focus(Direction.Last)
+        for _ in range(from_end):
+            ax.move_focus(Direction.Previous)
+    else:
         ax.move_focus(Direction.First)
-        # Navigate forward to target
         for _ in range(target_ref):
             ax.move_focus(Direction.Next)
-    json.dump({'focused': target_ref}, sys.stdout)
-    sys.stdout.write('\n')
 
 
-def main():
+def cmd_dump(rsd, ndjson=False, compact=False, no_ref=False):
+    """Stream all accessibility elements to stdout as they are enumerated."""
+    from pymobiledevice3.services.accessibilityaudit import AccessibilityAudit
+
+    with AccessibilityAudit(rsd) as ax, open_stdout() as out:
+        write_dump(ax, out, ndjson=ndjson, compact=compact, no_ref=no_ref)
+
+
+def cmd_focus(rsd, target_ref, total=None):
+    """Navigate focus to element at ref index."""
+    from pymobiledevice3.services.accessibilityaudit import AccessibilityAudit
+
+    with AccessibilityAudit(rsd) as ax:
+        move_focus_to(ax, target_ref, total=total)
+    write_json({'focused': target_ref})
+
+
+def cmd_serve(rsd):
+    """Keep one AccessibilityAudit open and answer commands from stdin.
+
+    One JSON command per line, one JSON response line per command:
+        {"cmd": "dump"}                          -> [{...}, ...]
+        {"cmd": "dump", "compact": true}         -> [[0, "Settings", ...], ...]
+        {"cmd": "dump", "no_ref": true}          -> [{"label": ...}, ...]
+        {"cmd": "focus", "ref": 5, "total": 12}  -> {"focused": 5}
+    Errors are reported as {"error": "..."} and the loop keeps going.
+    """
+    from pymobiledevice3.services.accessibilityaudit import AccessibilityAudit
+
+    with AccessibilityAudit(rsd) as ax, open_stdout() as out:
+        for line in sys.stdin.buffer:
+            if not line.strip():
+                continue
+            try:
+                req = loads(line)
+                cmd = req.get('cmd')
+                if cmd == 'dump':
+                    # Buffered per command: a dump that fails partway must
+                    # not leave half an array on the response line
+                    buf = io.BytesIO()
+                    write_dump(ax, buf, compact=bool(req.get('compact')),
+                               no_ref=bool(req.get('no_ref')))
+                    out.write(buf.getbuffer())
+                elif cmd == 'focus':
+                    if 'ref' not in req:
+                        raise ValueError('focus needs "ref"')
+                    ref = int(req['ref'])
+                    total = req.get('total')
+                    move_focus_to(ax, ref, total=None if total is None else int(total))
+                    out.write(dumps({'focused': ref}) + b'\n')
+                else:
+                    out.write(dumps({'error': f'unknown command: {cmd}'}) + b'\n')
+            except Exception as e:
+                out.write(dumps({'error': str(e)}) + b'\n')
+            out.flush()
+
+
+async def run(args):
+    """Connect, run the command, and close the RSD connection in one loop.
+
+    AccessibilityAudit is sync-only, so the commands themselves stay sync;
+    this just keeps connect and close on the same loop and stops the
+    transport leaking at exit.
+    """
+    rsd = await connect_rsd(args.rsd[0], args.rsd[1])
+    try:
+        if args.command == 'dump':
+            cmd_dump(rsd, ndjson=args.ndjson, compact=args.compact,
+                     no_ref=args.no_ref)
+        elif args.command == 'focus':
+            cmd_focus(rsd, args.ref, total=args.total)
+        elif args.command == 'serve':
+            cmd_serve(rsd)
+    finally:
+        await rsd.close()
+
+
+def parse_args():
+    import argparse
+
     parser = argparse.ArgumentParser(description='iOS accessibility helper')
     parser.add_argument('--rsd', nargs=2, metavar=('HOST', 'PORT'), required=True)
     sub = parser.add_subparsers(dest='command', required=True)
-    sub.add_parser('dump')
+    dump_p = sub.add_parser('dump')
+    dump_p.add_argument('--ndjson', action='store_true',
+                        help='one JSON object per line instead of an array')
+    dump_p.add_argument('--compact', action='store_true',
+                        help='emit [ref, label, role, value, traits, caption] rows instead of objects')
+    dump_p.add_argument('--no-ref', action='store_true',
+                        help='omit ref; it always equals the element\'s array position')
     focus_p = sub.add_parser('focus')
     focus_p.add_argument('ref', type=int)
-    args = parser.parse_args()
+    focus_p.add_argument('--total', type=int,
+                         help='element count from the last dump (enables walking back from the end)')
+    sub.add_parser('serve', help='hold the connection open; read JSON commands from stdin')
+    return parser.parse_args()
 
-    rsd = asyncio.run(connect_rsd(args.rsd[0], args.rsd[1]))
 
-    if args.command == 'dump':
-        cmd_dump(rsd)
-    elif args.command == 'focus':
-        cmd_focus(rsd, args.ref)
+def fast_args(argv):
+    """Parse the canonical argv shapes without argparse; None if unusual.
+
+    Covers "--rsd HOST PORT dump|serve" and "--rsd HOST PORT focus N" —
+    what callers send in a loop. Anything else (flags, --help, errors)
+    goes through argparse.
+    """
+    if len(argv) < 4 or argv[0] != '--rsd':
+        return None
+    host, port, command, rest = argv[1], argv[2], argv[3], argv[4:]
+    if command in ('dump', 'serve') and not rest:
+        return SimpleNamespace(rsd=[host, port], command=command,
+                               ndjson=False, compact=False, no_ref=False)
+    if command == 'focus' and len(rest) == 1 and rest[0].isdecimal():
+        return SimpleNamespace(rsd=[host, port], command=command,
+                               ref=int(rest[0]), total=None)
+    return None
+
+
+def main():
+    args = fast_args(sys.argv[1:])
+    if args is None:
+        args = parse_args()
+    asyncio.run(run(args))
 
 
 if __name__ == '__main__':